@@ -0,0 +1,46 @@
+# Serial commands understood by the Waveshare rover's ESP32 controller
+
+# Command types ("T" field)
+MOTOR_CONTROL = 1
+IMU_QUERY = 126
+
+# IMU query command, pre-encoded since it never changes
+IMU_QUERY_COMMAND = b'{"T": 126}\n'
+
+# Motor control command with left/right motor values, newline terminated
+MOTOR_COMMAND_FORMAT = b'{"T":1,"L":%.3f,"R":%.3f}\n'
+
+def format_motor_command(throttle, steering):
+    """
+    Mix gamepad throttle and steering into a serial motor control command.
+    
+    Args:
+        throttle: Left thumbstick Y value in range [-1, 1]
+        steering: Right thumbstick X value in range [-1, 1]
+    
+    Returns:
+        Newline terminated motor command JSON as bytes
+    """
+    # Scale throttle to [-0.5, 0.5] range
+    throttle_scaled = round(throttle * 0.5, 3)
+    
+    # Apply Gord_W's formula: y = a * x^3 + (1-a) * x
+    # Using a = 0.5 for a good balance between linear and cubic response,
+    # folded together with the 0.3 steering scale:
+    # 0.3 * (0.5 * x^3 + 0.5 * x) = 0.15 * x * (x^2 + 1)
+    steering_effect = 0.15 * steering * (steering * steering + 1.0)
+    
+    # Invert steering when in reverse
+    if throttle_scaled < 0:
+        steering_effect = -steering_effect
+    
+    # Mix throttle and steering
+    left_motor = throttle_scaled + steering_effect
+    right_motor = throttle_scaled - steering_effect
+    
+    # Clamp to the valid range [-0.5, 0.5]
+    left_motor = 0.5 if left_motor > 0.5 else -0.5 if left_motor < -0.5 else left_motor
+    right_motor = 0.5 if right_motor > 0.5 else -0.5 if right_motor < -0.5 else right_motor
+    
+    # Format the motor command JSON, rounded to 3 decimal places
+    return MOTOR_COMMAND_FORMAT % (left_motor, right_motor)
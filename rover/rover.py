@@ -4,6 +4,8 @@
 #   "livekit",
 #   "livekit_api",
 #   "pyserial",
+#   "orjson",
+#   "msgspec",
 #   "python-dotenv",
 #   "asyncio",
 # ]
@@ -13,11 +15,15 @@ import os
 import logging
 import asyncio
 import json
+import threading
+import orjson
+import msgspec
 import serial
 from dotenv import load_dotenv
 from signal import SIGINT, SIGTERM
 from livekit import rtc
 from auth import generate_token
+from commands import IMU_QUERY, IMU_QUERY_COMMAND, MOTOR_CONTROL, format_motor_command
 
 load_dotenv()
 # ensure LIVEKIT_URL, LIVEKIT_API_KEY, and LIVEKIT_API_SECRET are set in your .env file
@@ -25,6 +31,62 @@ LIVEKIT_URL = os.environ.get("LIVEKIT_URL")
 ROOM_NAME = os.environ.get("ROOM_NAME")
 ROVER_PORT = os.environ.get("ROVER_PORT")
 
+# Max seconds a serial write may block; a motor command takes ~3ms at 115200 baud
+SERIAL_WRITE_TIMEOUT = 0.05
+
+class Thumbsticks(msgspec.Struct):
+    """Gamepad thumbstick axes, each in range [-1, 1]."""
+    left_x: float
+    left_y: float
+    right_x: float
+    right_y: float
+
+class GamepadPacket(msgspec.Struct):
+    """Control packet published by the controller app."""
+    type: str
+    data: Thumbsticks
+
+gamepad_packet_decoder = msgspec.json.Decoder(GamepadPacket)
+
+# Long-running tasks started by main(); the event loop only holds weak references
+background_tasks: set[asyncio.Task] = set()
+
+class SerialWriter:
+    """Write commands to the serial port from a background thread.
+
+    Commands are keyed by their "T" type and only the newest unsent command of
+    each type is kept, so bursts of gamepad updates coalesce into the most recent
+    motor command instead of queueing up behind a slow serial link.
+    """
+
+    def __init__(self, ser: serial.Serial, logger: logging.Logger):
+        self._ser = ser
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._pending: dict[int, bytes] = {}
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._run, name="serial-writer", daemon=True).start()
+
+    def send(self, command_type: int, command: bytes):
+        """Queue a command, replacing any unsent command of the same type."""
+        with self._lock:
+            self._pending[command_type] = command
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._wakeup.clear()
+            for command in pending.values():
+                try:
+                    self._ser.write(command)
+                except serial.SerialTimeoutException:
+                    self._logger.warning("Serial write timed out, dropping command: %s", command.decode().rstrip())
+                except Exception as e:
+                    self._logger.error("Error writing to serial port: %s", e)
+
 async def read_serial_data(ser: serial.Serial, logger: logging.Logger, room: rtc.Room = None):
     """Read and parse data from serial port."""
     if not ser or not ser.is_open:
@@ -64,34 +126,29 @@ async def read_serial_data(ser: serial.Serial, logger: logging.Logger, room: rtc
                             'temp': data.get('temp', 0)      # Temperature in Celsius
                         }
                     }
-                    logger.info(f"Parsed IMU data: {imu_data}")
+                    logger.debug("Parsed IMU data: %s", imu_data)
                     
                     # Publish IMU data to room if available
                     if room and room.isconnected:
                         try:
                             await room.local_participant.publish_data(
-                                json.dumps(imu_data).encode(),
+                                orjson.dumps(imu_data),
                                 topic="imu",
                                 reliable=False
                             )
                         except Exception as e:
-                            logger.error(f"Failed to publish IMU data: {e}")
+                            logger.error("Failed to publish IMU data: %s", e)
             except json.JSONDecodeError:
-                logger.warning(f"Failed to parse JSON from serial: {line}")
+                logger.warning("Failed to parse JSON from serial: %s", line)
     except Exception as e:
-        logger.error(f"Error reading serial data: {e}")
+        logger.error("Error reading serial data: %s", e)
 
-async def send_imu_query(ser: serial.Serial, logger: logging.Logger):
+async def send_imu_query(serial_writer: SerialWriter, logger: logging.Logger):
     """Send IMU query command to serial port."""
-    if not ser or not ser.is_open:
+    if not serial_writer:
         return
     
-    try:
-        command = {"T": 126}
-        command_json = json.dumps(command) + "\n"
-        ser.write(command_json.encode())
-    except Exception as e:
-        logger.error(f"Error sending IMU query: {e}")
+    serial_writer.send(IMU_QUERY, IMU_QUERY_COMMAND)
 
 async def main(room: rtc.Room):
     logging.basicConfig(level=logging.INFO)
@@ -107,18 +164,27 @@ async def main(room: rtc.Room):
         else:
             port = ROVER_PORT
             
-        # Create serial connection with 115200 baud rate using standard serial library
-        ser = serial.Serial(port, 115200, timeout=1)
+        # Create serial connection with 115200 baud rate using standard serial library.
+        # Bound writes so a stalled UART drops commands instead of blocking the writer.
+        ser = serial.Serial(port, 115200, timeout=1, write_timeout=SERIAL_WRITE_TIMEOUT)
         logger.info(f"Successfully connected to serial port {port} at 115200 baud")
+        try:
+            # Disable the driver's receive latency timer (e.g. 16ms on FTDI) where supported
+            ser.set_low_latency_mode(True)
+        except Exception as e:
+            logger.info("Serial low latency mode not available: %s", e)
     except Exception as e:
         logger.warning(f"Failed to connect to serial port: {e}")
         logger.info("Continuing without serial connection - will only log received data")
         ser = None
 
+    # All serial writes go through a single writer thread to keep them off the event loop
+    serial_writer = SerialWriter(ser, logger) if ser and ser.is_open else None
+
     # Start periodic IMU query task
     async def periodic_imu_query():
         while True:
-            await send_imu_query(ser, logger)
+            await send_imu_query(serial_writer, logger)
             await asyncio.sleep(0.1)  # 10Hz = 0.1 seconds
 
     # Start periodic serial data reading task
@@ -127,89 +193,45 @@ async def main(room: rtc.Room):
             await read_serial_data(ser, logger, room)
             await asyncio.sleep(0.01)  # Read at 100Hz to ensure we don't miss data
 
-    # Start the periodic tasks if we have a serial connection
+    # Start the periodic tasks if we have a serial connection.
+    # Keep strong references so the tasks aren't garbage collected mid-run.
     if ser and ser.is_open:
-        asyncio.create_task(periodic_imu_query())
-        asyncio.create_task(periodic_serial_read())
+        for coro in (periodic_imu_query(), periodic_serial_read()):
+            task = asyncio.create_task(coro)
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
 
     # handler for receiving data packet
     @room.on("data_received")
     def on_data_received(data: rtc.DataPacket):
-        logger.info("Received data from %s topic: %s", data.participant.identity, data.topic)
+        logger.debug("Received data from %s topic: %s", data.participant.identity, data.topic)
         try:
-            # Decode and parse the data
-            decoded_data = data.data.decode('utf-8')
-            
-            # Try to parse as JSON
-            json_data = json.loads(decoded_data)
+            # Parse and validate the packet against the gamepad schema in one pass
+            packet = gamepad_packet_decoder.decode(data.data)
             
             # First validate that data is of type 'gamepad'
-            if not json_data.get('type') == 'gamepad':
+            if packet.type != 'gamepad':
                 logger.info("Received data is not of type 'gamepad', ignoring")
                 return
                 
-            # Get the gamepad data
-            gamepad_data = json_data.get('data', {})
+            # Get the throttle (left_y) and steering (right_x) values
+            # Gamepad values are typically in range [-1, 1]
+            serial_command = format_motor_command(packet.data.left_y, packet.data.right_x)
             
-            # Check if we have the expected thumbstick values
-            if all(k in gamepad_data for k in ["left_x", "left_y", "right_x", "right_y"]):
-                # Get the throttle (left_y) and steering (right_x) values
-                # Gamepad values are typically in range [-1, 1]
-                throttle = float(gamepad_data['left_y'])
-                steering = float(gamepad_data['right_x'])
-                
-                # Scale throttle to [-0.5, 0.5] range
-                throttle_scaled = round(throttle * 0.5, 3)
-                
-                # Apply Gord_W's formula: y = a * x^3 + (1-a) * x
-                # Using a = 0.5 for a good balance between linear and cubic response
-                a = 0.5
-                steering_curved = a * (steering ** 3) + (1 - a) * steering
-                
-                # Calculate base steering effect (opposing motor commands)
-                steering_effect = steering_curved * 0.3  # Scale steering effect
-                
-                # Invert steering when in reverse
-                if throttle_scaled < 0:
-                    steering_effect = -steering_effect
-                
-                # Mix throttle and steering
-                left_motor = throttle_scaled + steering_effect
-                right_motor = throttle_scaled - steering_effect
-                
-                # Ensure values stay within the valid range [-0.5, 0.5]
-                left_motor = max(min(left_motor, 0.5), -0.5)
-                right_motor = max(min(right_motor, 0.5), -0.5)
-                
-                # Round to 3 decimal places
-                left_motor = round(left_motor, 3)
-                right_motor = round(right_motor, 3)
-                
-                # Create command JSON as specified
-                command_data = {
-                    "T": 1,  # Type 1 for motor control
-                    "L": left_motor,
-                    "R": right_motor
-                }
-                print(f"command_data: {command_data}")
-                # Convert to JSON string
-                command_json = json.dumps(command_data)
-                
-                # Forward to serial port if connection is available
-                if ser and ser.is_open:
-                    # Add newline for serial transmission
-                    serial_command = command_json + "\n"
-                    ser.write(serial_command.encode())
-                    logger.info(f"Successfully sent to serial port: {command_json}")
-                else:
-                    logger.info("Serial connection not available - data logged but not sent")
-            else:
-                logger.info("Received data does not contain expected thumbstick values")
+            # Forward to serial port if connection is available
+            if serial_writer:
+                serial_writer.send(MOTOR_CONTROL, serial_command)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Queued for serial port: %s", serial_command.decode().rstrip())
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Serial connection not available - command not sent: %s", serial_command.decode().rstrip())
                 
-        except (UnicodeDecodeError, json.JSONDecodeError) as e:
-            logger.error(f"Error decoding/parsing data: {e}")
+        except msgspec.ValidationError as e:
+            logger.info("Received data does not contain expected thumbstick values: %s", e)
+        except msgspec.DecodeError as e:
+            logger.error("Error decoding/parsing data: %s", e)
         except Exception as e:
-            logger.error(f"Error processing data: {e}")
+            logger.error("Error processing data: %s", e)
 
     token = generate_token(ROOM_NAME, "rover", "Rover Receiver")
     await room.connect(LIVEKIT_URL, token, rtc.RoomOptions(auto_subscribe=False))